@@ -1,13 +1,33 @@
 from __future__ import annotations
 
+from collections import deque
 from dataclasses import dataclass
 import json
+import os
+import re
 import shlex
+import signal
 import subprocess
+import threading
+
+try:  # orjson заметно быстрее на мелких событиях; stdlib json — запасной путь.
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
 
 from .config import Settings
 
 
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+
+# Сколько последних строк stdout держать для fallback-текстов при стриминге.
+STDOUT_TAIL_LINES = 400
+
+# Строка-событие codex: JSON-объект, занимающий строку целиком.
+_JSON_EVENT_LINE_RE = re.compile(r"\{.*\}$")
+
+
 @dataclass
 class CodexRunResult:
     success: bool
@@ -16,73 +36,144 @@ class CodexRunResult:
     timed_out: bool = False
 
 
+@dataclass
+class _StreamedRun:
+    returncode: int
+    session_id: str
+    last_agent_message: str
+    stdout_tail: str
+    stderr: str
+
+
 class CodexRunner:
     def __init__(self, settings: Settings) -> None:
         self._settings = settings
-
-    def _append_common_options(self, command: list[str]) -> None:
-        if self._settings.codex_model:
-            command.extend(["-m", self._settings.codex_model])
-        if self._settings.codex_extra_args:
-            command.extend(shlex.split(self._settings.codex_extra_args))
-
-    def _build_exec_command(self, prompt: str) -> list[str]:
-        command = [
-            self._settings.codex_bin,
+        self._cwd = os.fspath(settings.assistant_root)
+        common_options: list[str] = []
+        if settings.codex_model:
+            common_options.extend(["-m", settings.codex_model])
+        if settings.codex_extra_args:
+            common_options.extend(shlex.split(settings.codex_extra_args))
+        self._exec_prefix = [
+            settings.codex_bin,
             "exec",
             "--json",
             "--skip-git-repo-check",
             "--cd",
-            str(self._settings.assistant_root),
+            self._cwd,
+            *common_options,
         ]
-        self._append_common_options(command)
-        command.append(prompt)
-        return command
-
-    def _build_resume_command(self, session_id: str, prompt: str) -> list[str]:
-        command = [
-            self._settings.codex_bin,
+        self._resume_prefix = [
+            settings.codex_bin,
             "exec",
             "resume",
             "--json",
             "--skip-git-repo-check",
+            *common_options,
         ]
-        self._append_common_options(command)
-        command.append(session_id)
-        command.append(prompt)
-        return command
 
-    def _run_once(self, command: list[str], timeout_sec: int) -> subprocess.CompletedProcess[str]:
-        return subprocess.run(
+    def _build_exec_command(self, prompt: str) -> list[str]:
+        return [*self._exec_prefix, prompt]
+
+    def _build_resume_command(self, session_id: str, prompt: str) -> list[str]:
+        return [*self._resume_prefix, session_id, prompt]
+
+    def _run_streaming(self, command: list[str], timeout_sec: int) -> _StreamedRun:
+        proc = subprocess.Popen(
             command,
-            capture_output=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
             text=True,
-            timeout=timeout_sec,
-            cwd=self._settings.assistant_root,
+            bufsize=1,
+            cwd=self._cwd,
+            start_new_session=True,
+        )
+
+        stderr_chunks: list[str] = []
+
+        def _drain_stderr() -> None:
+            if proc.stderr is not None:
+                stderr_chunks.append(proc.stderr.read())
+
+        stderr_thread = threading.Thread(target=_drain_stderr, daemon=True)
+        stderr_thread.start()
+
+        timed_out = threading.Event()
+
+        def _kill_on_timeout() -> None:
+            timed_out.set()
+            self._kill_process_tree(proc)
+
+        timer = threading.Timer(timeout_sec, _kill_on_timeout)
+        timer.start()
+
+        session_id = ""
+        last_agent_message = ""
+        tail: deque[str] = deque(maxlen=STDOUT_TAIL_LINES)
+        try:
+            if proc.stdout is not None:
+                for raw_line in proc.stdout:
+                    tail.append(raw_line.rstrip("\n"))
+                    line_session_id, agent_message = self._parse_json_line(raw_line)
+                    if line_session_id:
+                        session_id = line_session_id
+                    if agent_message:
+                        last_agent_message = agent_message
+            returncode = proc.wait()
+        finally:
+            timer.cancel()
+            stderr_thread.join(timeout=5)
+
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(command, timeout_sec)
+
+        return _StreamedRun(
+            returncode=returncode,
+            session_id=session_id,
+            last_agent_message=last_agent_message,
+            stdout_tail="\n".join(tail),
+            stderr="".join(stderr_chunks),
         )
 
     @staticmethod
-    def _parse_json_output(stdout: str) -> tuple[str, str]:
+    def _kill_process_tree(proc: subprocess.Popen[str]) -> None:
+        # codex может порождать вспомогательные процессы; убиваем всю группу,
+        # чтобы после таймаута не оставались сироты, выжигающие CPU.
+        try:
+            os.killpg(os.getpgid(proc.pid), signal.SIGKILL)
+        except (ProcessLookupError, PermissionError, OSError):
+            proc.kill()
+
+    @staticmethod
+    def _parse_json_line(raw_line: str) -> tuple[str, str]:
+        line = raw_line.strip()
+        if not line.startswith("{"):
+            return "", ""
+        try:
+            event = _json_loads(line)
+        except ValueError:
+            return "", ""
+        if event.get("type") == "thread.started":
+            return str(event.get("thread_id") or ""), ""
+        if event.get("type") != "item.completed":
+            return "", ""
+        item = event.get("item") or {}
+        if item.get("type") == "agent_message":
+            text = str(item.get("text") or "").strip()
+            if text:
+                return "", text
+        return "", ""
+
+    @classmethod
+    def _parse_json_output(cls, stdout: str) -> tuple[str, str]:
         session_id = ""
         last_agent_message = ""
         for raw_line in stdout.splitlines():
-            line = raw_line.strip()
-            if not line.startswith("{"):
-                continue
-            try:
-                event = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-            if event.get("type") == "thread.started":
-                session_id = str(event.get("thread_id") or session_id)
-                continue
-            if event.get("type") != "item.completed":
-                continue
-            item = event.get("item") or {}
-            if item.get("type") == "agent_message":
-                text = str(item.get("text") or "").strip()
-                if text:
-                    last_agent_message = text
+            line_session_id, agent_message = cls._parse_json_line(raw_line)
+            if line_session_id:
+                session_id = line_session_id
+            if agent_message:
+                last_agent_message = agent_message
         return session_id, last_agent_message
 
     @staticmethod
@@ -92,15 +183,8 @@ class CodexRunner:
 
     @staticmethod
     def _non_json_lines(text: str) -> list[str]:
-        result: list[str] = []
-        for raw_line in (text or "").splitlines():
-            line = raw_line.strip()
-            if not line:
-                continue
-            if line.startswith("{") and line.endswith("}"):
-                continue
-            result.append(line)
-        return result
+        stripped = (raw_line.strip() for raw_line in (text or "").splitlines())
+        return [line for line in stripped if line and _JSON_EVENT_LINE_RE.match(line) is None]
 
     @classmethod
     def _failure_text(cls, stdout: str, stderr: str) -> str:
@@ -136,19 +220,18 @@ class CodexRunner:
             else:
                 command = self._build_exec_command(prompt=prompt)
             effective_timeout = timeout_sec or self._settings.codex_timeout_sec
-            completed = self._run_once(command, effective_timeout)
+            streamed = self._run_streaming(command, effective_timeout)
         except FileNotFoundError:
             return CodexRunResult(False, "Failed to run codex: binary not found", "")
         except subprocess.TimeoutExpired:
             return CodexRunResult(False, "Codex execution timed out", session_id, timed_out=True)
 
-        parsed_session_id, parsed_message = self._parse_json_output(completed.stdout or "")
-        effective_session_id = parsed_session_id or session_id
-        if completed.returncode != 0:
+        effective_session_id = streamed.session_id or session_id
+        if streamed.returncode != 0:
             return CodexRunResult(
                 False,
-                self._failure_text(completed.stdout or "", completed.stderr or ""),
+                self._failure_text(streamed.stdout_tail, streamed.stderr),
                 effective_session_id,
             )
-        message = self._success_text(parsed_message, completed.stdout or "")
+        message = self._success_text(streamed.last_agent_message, streamed.stdout_tail)
         return CodexRunResult(True, message, effective_session_id)
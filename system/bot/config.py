@@ -3,6 +3,12 @@ from __future__ import annotations
 from dataclasses import dataclass
 from pathlib import Path
 import os
+import re
+
+
+_TRUE_VALUES = frozenset({"1", "true", "yes", "on"})
+_FALSE_VALUES = frozenset({"0", "false", "no", "off"})
+_INT_SET_SPLIT_RE = re.compile(r"[\s,]+")
 
 
 def _parse_int(value: str | None, default: int) -> int:
@@ -15,30 +21,25 @@ def _parse_bool(value: str | None, default: bool) -> bool:
     if value is None or value.strip() == "":
         return default
     normalized = value.strip().lower()
-    if normalized in {"1", "true", "yes", "on"}:
+    if normalized in _TRUE_VALUES:
         return True
-    if normalized in {"0", "false", "no", "off"}:
+    if normalized in _FALSE_VALUES:
         return False
     raise ValueError(f"Invalid boolean value: {value}")
 
 
-def _parse_int_set(value: str | None) -> set[int]:
+def _parse_int_set(value: str | None) -> frozenset[int]:
     if not value:
-        return set()
-    result: set[int] = set()
-    for token in value.split(","):
-        token = token.strip()
-        if token:
-            result.add(int(token))
-    return result
+        return frozenset()
+    return frozenset(int(token) for token in _INT_SET_SPLIT_RE.split(value) if token)
 
 
 @dataclass(frozen=True)
 class Settings:
     assistant_root: Path
     telegram_token: str
-    allowed_user_ids: set[int]
-    allowed_chat_ids: set[int]
+    allowed_user_ids: frozenset[int]
+    allowed_chat_ids: frozenset[int]
     poll_timeout_sec: int
     idle_sleep_sec: float
     codex_bin: str
@@ -73,85 +74,95 @@ class Settings:
     autonomy_guard_max_codex_calls_per_hour: int = 3
     autonomy_guard_rolling_window_sec: int = 3600
     session_lease_sec: int = 1860
+    worker_concurrency: int = 1
+    # Предвычисляется в from_env: оба allowlist'а пусты — авторизация открыта
+    # и проверка принадлежности множествам не нужна вовсе.
+    auth_open: bool = False
 
     @classmethod
     def from_env(cls) -> "Settings":
+        env = os.environ
         default_root = Path(__file__).resolve().parents[2]
         assistant_root = Path(
-            os.getenv("ASSISTANT_ROOT", str(default_root))
+            env.get("ASSISTANT_ROOT", str(default_root))
         ).expanduser().resolve()
 
-        token = os.getenv("TG_BOT_TOKEN", "").strip()
+        token = env.get("TG_BOT_TOKEN", "").strip()
         if not token:
             raise ValueError("Missing required env var: TG_BOT_TOKEN")
 
         state_db = Path(
-            os.getenv(
+            env.get(
                 "BOT_STATE_DB",
                 str(assistant_root / "system" / "tasks" / "bot_state.db"),
             )
-        ).expanduser().resolve()
+        ).expanduser()
+
+        allowed_user_ids = _parse_int_set(env.get("TG_ALLOWED_USER_IDS"))
+        allowed_chat_ids = _parse_int_set(env.get("TG_ALLOWED_CHAT_IDS"))
 
         return cls(
             assistant_root=assistant_root,
             telegram_token=token,
-            allowed_user_ids=_parse_int_set(os.getenv("TG_ALLOWED_USER_IDS")),
-            allowed_chat_ids=_parse_int_set(os.getenv("TG_ALLOWED_CHAT_IDS")),
-            poll_timeout_sec=_parse_int(os.getenv("TG_POLL_TIMEOUT_SEC"), 25),
-            idle_sleep_sec=float(os.getenv("BOT_IDLE_SLEEP_SEC", "1.0")),
-            codex_bin=os.getenv("CODEX_BIN", "codex"),
-            codex_timeout_sec=_parse_int(os.getenv("CODEX_TIMEOUT_SEC"), 1800),
-            codex_model=os.getenv("CODEX_MODEL", "").strip(),
-            codex_extra_args=os.getenv("CODEX_EXTRA_ARGS", "").strip(),
-            max_result_chars=_parse_int(os.getenv("BOT_MAX_RESULT_CHARS"), 3500),
-            max_send_file_bytes=_parse_int(os.getenv("BOT_MAX_SEND_FILE_BYTES"), 50 * 1024 * 1024),
-            openrouter_api_key=os.getenv("OPENROUTER_API_KEY", "").strip(),
-            openrouter_base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").strip(),
-            openrouter_stt_model=os.getenv("OPENROUTER_STT_MODEL", "mistralai/voxtral-small-24b-2507").strip(),
-            openrouter_stt_timeout_sec=_parse_int(os.getenv("OPENROUTER_STT_TIMEOUT_SEC"), 90),
-            openrouter_stt_max_audio_bytes=_parse_int(os.getenv("OPENROUTER_STT_MAX_AUDIO_BYTES"), 25 * 1024 * 1024),
+            allowed_user_ids=allowed_user_ids,
+            allowed_chat_ids=allowed_chat_ids,
+            auth_open=not allowed_user_ids and not allowed_chat_ids,
+            poll_timeout_sec=_parse_int(env.get("TG_POLL_TIMEOUT_SEC"), 25),
+            idle_sleep_sec=float(env.get("BOT_IDLE_SLEEP_SEC", "1.0")),
+            codex_bin=env.get("CODEX_BIN", "codex"),
+            codex_timeout_sec=_parse_int(env.get("CODEX_TIMEOUT_SEC"), 1800),
+            codex_model=env.get("CODEX_MODEL", "").strip(),
+            codex_extra_args=env.get("CODEX_EXTRA_ARGS", "").strip(),
+            max_result_chars=_parse_int(env.get("BOT_MAX_RESULT_CHARS"), 3500),
+            max_send_file_bytes=_parse_int(env.get("BOT_MAX_SEND_FILE_BYTES"), 50 * 1024 * 1024),
+            openrouter_api_key=env.get("OPENROUTER_API_KEY", "").strip(),
+            openrouter_base_url=env.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").strip(),
+            openrouter_stt_model=env.get("OPENROUTER_STT_MODEL", "mistralai/voxtral-small-24b-2507").strip(),
+            openrouter_stt_timeout_sec=_parse_int(env.get("OPENROUTER_STT_TIMEOUT_SEC"), 90),
+            openrouter_stt_max_audio_bytes=_parse_int(env.get("OPENROUTER_STT_MAX_AUDIO_BYTES"), 25 * 1024 * 1024),
             state_db_path=state_db,
-            log_level=os.getenv("BOT_LOG_LEVEL", "INFO").upper(),
-            autonomy_enabled=_parse_bool(os.getenv("AUTONOMY_ENABLED"), False),
-            autonomy_heartbeat_sec=_parse_int(os.getenv("AUTONOMY_HEARTBEAT_SEC"), 300),
+            log_level=env.get("BOT_LOG_LEVEL", "INFO").upper(),
+            autonomy_enabled=_parse_bool(env.get("AUTONOMY_ENABLED"), False),
+            autonomy_heartbeat_sec=_parse_int(env.get("AUTONOMY_HEARTBEAT_SEC"), 300),
             autonomy_loop_poll_sec=_parse_int(
-                os.getenv("AUTONOMY_LOOP_POLL_SEC"),
-                _parse_int(os.getenv("AUTONOMY_HEARTBEAT_SEC"), 300),
+                env.get("AUTONOMY_LOOP_POLL_SEC"),
+                _parse_int(env.get("AUTONOMY_HEARTBEAT_SEC"), 300),
             ),
             autonomy_default_sleep_sec=_parse_int(
-                os.getenv("AUTONOMY_DEFAULT_SLEEP_SEC"), 7200
+                env.get("AUTONOMY_DEFAULT_SLEEP_SEC"), 7200
             ),
             autonomy_post_complete_sleep_sec=_parse_int(
-                os.getenv("AUTONOMY_POST_COMPLETE_SLEEP_SEC"), 10800
+                env.get("AUTONOMY_POST_COMPLETE_SLEEP_SEC"), 10800
             ),
             autonomy_empty_idle_sleep_sec=_parse_int(
-                os.getenv("AUTONOMY_EMPTY_IDLE_SLEEP_SEC"), 10800
+                env.get("AUTONOMY_EMPTY_IDLE_SLEEP_SEC"), 10800
             ),
             autonomy_busy_retry_sec=_parse_int(
-                os.getenv("AUTONOMY_BUSY_RETRY_SEC"), 120
+                env.get("AUTONOMY_BUSY_RETRY_SEC"), 120
             ),
             autonomy_session_step_limit=_parse_int(
-                os.getenv("AUTONOMY_SESSION_STEP_LIMIT"), 4
+                env.get("AUTONOMY_SESSION_STEP_LIMIT"), 4
             ),
             autonomy_max_task_continuations=_parse_int(
-                os.getenv("AUTONOMY_MAX_TASK_CONTINUATIONS"), 5
+                env.get("AUTONOMY_MAX_TASK_CONTINUATIONS"), 5
             ),
-            autonomy_notify_enabled=_parse_bool(os.getenv("AUTONOMY_NOTIFY_ENABLED"), False),
-            autonomy_notify_min_chars=_parse_int(os.getenv("AUTONOMY_NOTIFY_MIN_CHARS"), 220),
-            autonomy_notify_cooldown_sec=_parse_int(os.getenv("AUTONOMY_NOTIFY_COOLDOWN_SEC"), 10800),
-            autonomy_idle_ask_enabled=_parse_bool(os.getenv("AUTONOMY_IDLE_ASK_ENABLED"), True),
+            autonomy_notify_enabled=_parse_bool(env.get("AUTONOMY_NOTIFY_ENABLED"), False),
+            autonomy_notify_min_chars=_parse_int(env.get("AUTONOMY_NOTIFY_MIN_CHARS"), 220),
+            autonomy_notify_cooldown_sec=_parse_int(env.get("AUTONOMY_NOTIFY_COOLDOWN_SEC"), 10800),
+            autonomy_idle_ask_enabled=_parse_bool(env.get("AUTONOMY_IDLE_ASK_ENABLED"), True),
             autonomy_idle_ask_cooldown_sec=_parse_int(
-                os.getenv("AUTONOMY_IDLE_ASK_COOLDOWN_SEC"), 21600
+                env.get("AUTONOMY_IDLE_ASK_COOLDOWN_SEC"), 21600
             ),
-            autonomy_idle_sleep_sec=_parse_int(os.getenv("AUTONOMY_IDLE_SLEEP_SEC"), 21600),
+            autonomy_idle_sleep_sec=_parse_int(env.get("AUTONOMY_IDLE_SLEEP_SEC"), 21600),
             autonomy_guard_max_continuous_runtime_sec=_parse_int(
-                os.getenv("AUTONOMY_GUARD_MAX_CONTINUOUS_RUNTIME_SEC"), 1200
+                env.get("AUTONOMY_GUARD_MAX_CONTINUOUS_RUNTIME_SEC"), 1200
             ),
             autonomy_guard_max_codex_calls_per_hour=_parse_int(
-                os.getenv("AUTONOMY_GUARD_MAX_CODEX_CALLS_PER_HOUR"), 3
+                env.get("AUTONOMY_GUARD_MAX_CODEX_CALLS_PER_HOUR"), 3
             ),
             autonomy_guard_rolling_window_sec=_parse_int(
-                os.getenv("AUTONOMY_GUARD_ROLLING_WINDOW_SEC"), 3600
+                env.get("AUTONOMY_GUARD_ROLLING_WINDOW_SEC"), 3600
             ),
-            session_lease_sec=_parse_int(os.getenv("BOT_SESSION_LEASE_SEC"), 1860),
+            session_lease_sec=_parse_int(env.get("BOT_SESSION_LEASE_SEC"), 1860),
+            worker_concurrency=max(1, _parse_int(env.get("BOT_WORKER_CONCURRENCY"), 1)),
         )
@@ -1,9 +1,13 @@
 from __future__ import annotations
 
+import asyncio
 from dataclasses import dataclass
+from functools import lru_cache
 import logging
+import os
 from pathlib import Path
 import re
+import stat
 
 from aiogram import Bot
 from aiogram.enums import ChatAction
@@ -12,7 +16,17 @@ from aiogram.types import FSInputFile, ReplyKeyboardRemove
 from .config import Settings
 
 
-SEND_FILE_LINE_RE = re.compile(r"^\s*\[\[send-file:(.+?)\]\]\s*$", re.IGNORECASE)
+SEND_FILE_LINE_RE = re.compile(
+    r"^[ \t]*\[\[send-file:(.+?)\]\][ \t]*\r?$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# Дешёвый literal-поиск маркера: почти все ответы без директив, и для них
+# полный multiline-скан с якорями не запускается.
+_SEND_FILE_PROBE = re.compile(r"\[\[send-file:", re.IGNORECASE).search
+
+# Ниже этого размера send_chat_action(UPLOAD_DOCUMENT) не отправляем.
+_CHAT_ACTION_MIN_BYTES = 256 * 1024
 
 
 @dataclass(frozen=True)
@@ -29,35 +43,64 @@ class DeliveryOutcome:
 
 
 def trim(text: str, limit: int) -> str:
-    clean = text.strip()
-    if len(clean) <= limit:
-        return clean
-    return clean[: limit - 120] + "\n\n[truncated]"
+    # Подавляющее большинство текстов короче лимита: одна проверка длины,
+    # и strip (дешёвый — смотрит только края) остаётся единственной работой.
+    if len(text) <= limit:
+        return text.strip()
+    # Для больших текстов strip-копию всего оригинала не делаем: границы
+    # пробелов находим индексами, аллоцируется только итоговый срез.
+    end = len(text)
+    while end and text[end - 1].isspace():
+        end -= 1
+    start = 0
+    while start < end and text[start].isspace():
+        start += 1
+    if end - start <= limit:
+        return text[start:end]
+    return text[start : start + limit - 120] + "\n\n[truncated]"
 
 
 def parse_agent_response(message: str) -> ParsedAgentResponse:
-    text_lines: list[str] = []
-    file_paths: list[str] = []
-    seen_paths: set[str] = set()
-
-    for raw_line in (message or "").splitlines():
-        line = raw_line.rstrip()
-        match = SEND_FILE_LINE_RE.match(line)
-        if not match:
-            text_lines.append(raw_line)
-            continue
+    if not message or _SEND_FILE_PROBE(message) is None:
+        return ParsedAgentResponse(text=(message or "").strip(), file_paths=[])
+
+    # Один multiline-проход regex-движка по всей строке вместо splitlines()
+    # со списком всех строк и match'ем на каждую. dict дедуплицирует
+    # с сохранением порядка — отдельный set не нужен.
+    file_paths: dict[str, None] = {}
+    text_parts: list[str] = []
+    pos = 0
+    for match in SEND_FILE_LINE_RE.finditer(message):
+        text_parts.append(message[pos : match.start()])
+        pos = match.end()
+        # Строка с директивой выпадает целиком, вместе со своим переводом строки.
+        if pos < len(message) and message[pos] == "\n":
+            pos += 1
 
         path = match.group(1).strip()
-        if not path or path in seen_paths:
-            continue
-        seen_paths.add(path)
-        file_paths.append(path)
+        if path:
+            file_paths[path] = None
+    text_parts.append(message[pos:])
+
+    return ParsedAgentResponse(
+        text="".join(text_parts).strip(), file_paths=list(file_paths)
+    )
 
-    return ParsedAgentResponse(text="\n".join(text_lines).strip(), file_paths=file_paths)
+
+# Пробелы, backtick'и и кавычки по краям снимаются одним strip вместо
+# цепочки из четырёх вызовов с промежуточными строками.
+_SEND_PATH_STRIP_CHARS = " \t\r\n`\"'"
 
 
 def normalize_send_path(raw_path: str) -> str:
-    return raw_path.strip().strip("`").strip().strip("\"'")
+    return raw_path.strip(_SEND_PATH_STRIP_CHARS)
+
+
+@lru_cache(maxsize=4)
+def _realpath_root(root: str) -> str:
+    # Корень не меняется за время жизни процесса — realpath один раз,
+    # а не на каждый отправляемый файл.
+    return os.path.realpath(root)
 
 
 def resolve_file_path_for_send(
@@ -65,37 +108,62 @@ def resolve_file_path_for_send(
     raw_path: str,
     max_size_bytes: int,
 ) -> tuple[Path | None, str]:
+    resolved_str, detail, _ = _resolve_file_for_send(assistant_root, raw_path, max_size_bytes)
+    return (Path(resolved_str) if resolved_str else None), detail
+
+
+def _resolve_file_for_send(
+    assistant_root: Path,
+    raw_path: str,
+    max_size_bytes: int,
+) -> tuple[str, str, int]:
+    """Возвращает (абсолютный путь или '', relative-путь/ошибка, размер).
+
+    Размер отдаётся наружу, чтобы отправка не делала повторный stat.
+    """
     cleaned_path = normalize_send_path(raw_path)
     if not cleaned_path:
-        return None, "Пустой путь к файлу."
-
-    requested = Path(cleaned_path)
-    resolved = (
-        (assistant_root / requested).resolve()
-        if not requested.is_absolute()
-        else requested.resolve()
+        return "", "Пустой путь к файлу.", 0
+
+    # realpath дешевле pathlib.resolve (один C-проход без промежуточных
+    # PurePath), а containment сводится к префикс-чеку по строкам.
+    root_str = _realpath_root(os.fspath(assistant_root))
+    candidate = (
+        cleaned_path
+        if os.path.isabs(cleaned_path)
+        else os.path.join(root_str, cleaned_path)
     )
+    resolved_str = os.path.realpath(candidate)
+    if resolved_str != root_str and not resolved_str.startswith(root_str + os.sep):
+        return "", f"Путь вне рабочей директории: `{cleaned_path}`", 0
+    relative_path = resolved_str[len(root_str) + 1 :].replace(os.sep, "/")
 
+    # Один os.stat вместо exists()/is_file()/stat(): каждый из них — отдельный
+    # syscall с полным обходом пути.
     try:
-        relative_path = resolved.relative_to(assistant_root).as_posix()
-    except ValueError:
-        return None, f"Путь вне рабочей директории: `{cleaned_path}`"
-
-    if not resolved.exists():
-        return None, f"Файл не найден: `{relative_path}`"
-    if not resolved.is_file():
-        return None, f"Это не файл: `{relative_path}`"
-
-    size = resolved.stat().st_size
+        st = os.stat(resolved_str)
+    except (FileNotFoundError, NotADirectoryError):
+        return "", f"Файл не найден: `{relative_path}`", 0
+    except OSError:
+        return "", f"Файл недоступен: `{relative_path}`", 0
+    if not stat.S_ISREG(st.st_mode):
+        return "", f"Это не файл: `{relative_path}`", 0
+
+    size = st.st_size
     if size > max_size_bytes:
-        return None, (
+        return "", (
             f"Файл слишком большой для отправки: `{relative_path}` "
             f"({size} bytes > {max_size_bytes} bytes)"
-        )
-    return resolved, relative_path
+        ), 0
+    return resolved_str, relative_path, size
 
 
-def compose_task_result_text(text: str, sent_files: list[str], send_errors: list[str]) -> str:
+def compose_task_result_text(
+    text: str,
+    sent_files: list[str],
+    send_errors: list[str],
+    limit: int = 0,
+) -> str:
     chunks: list[str] = []
     if text:
         chunks.append(text)
@@ -103,7 +171,10 @@ def compose_task_result_text(text: str, sent_files: list[str], send_errors: list
         chunks.append("Отправленные файлы:\n" + "\n".join(f"- {item}" for item in sent_files))
     if send_errors:
         chunks.append("Ошибки отправки файлов:\n" + "\n".join(f"- {item}" for item in send_errors))
-    return "\n\n".join(chunks).strip() or "(empty)"
+    result = "\n\n".join(chunks).strip() or "(empty)"
+    # Обрезка сразу здесь: вызывающему не нужно гонять готовую строку
+    # через отдельный trim со вторым strip-проходом.
+    return trim(result, limit) if limit else result
 
 
 async def safe_send_text(bot: Bot, chat_id: int, text: str, logger: logging.Logger) -> None:
@@ -125,24 +196,27 @@ async def safe_send_file(
     raw_path: str,
     logger: logging.Logger,
 ) -> tuple[str | None, str | None]:
-    resolved_path, detail = resolve_file_path_for_send(
+    resolved_path, detail, size = _resolve_file_for_send(
         assistant_root=settings.assistant_root,
         raw_path=raw_path,
         max_size_bytes=settings.max_send_file_bytes,
     )
-    if resolved_path is None:
+    if not resolved_path:
         return None, detail
     relative_path = detail
 
-    try:
-        await bot.send_chat_action(chat_id, ChatAction.UPLOAD_DOCUMENT)
-    except Exception:  # pragma: no cover
-        pass
+    # Мелкие файлы улетают быстрее, чем доходит сам chat action — лишний
+    # HTTP-вызов делаем только для заметных загрузок.
+    if size > _CHAT_ACTION_MIN_BYTES:
+        try:
+            await bot.send_chat_action(chat_id, ChatAction.UPLOAD_DOCUMENT)
+        except Exception:  # pragma: no cover
+            pass
 
     try:
         await bot.send_document(
             chat_id=chat_id,
-            document=FSInputFile(str(resolved_path)),
+            document=FSInputFile(resolved_path),
             caption=relative_path,
         )
         return relative_path, None
@@ -176,8 +250,25 @@ async def deliver_agent_response(
 
     sent_files: list[str] = []
     send_errors: list[str] = []
-    for raw_path in parsed.file_paths:
-        sent_file, error_text = await safe_send_file(bot, chat_id, settings, raw_path, logger)
+    if len(parsed.file_paths) == 1:
+        results = [
+            await safe_send_file(bot, chat_id, settings, parsed.file_paths[0], logger)
+        ]
+    elif parsed.file_paths:
+        # Загрузки перекрываются по сети: суммарное время ~ max(RTT), а не
+        # сумма. Семафор держит параллелизм ниже flood-лимитов Telegram.
+        semaphore = asyncio.Semaphore(4)
+
+        async def _send_limited(raw_path: str) -> tuple[str | None, str | None]:
+            async with semaphore:
+                return await safe_send_file(bot, chat_id, settings, raw_path, logger)
+
+        results = await asyncio.gather(
+            *(_send_limited(raw_path) for raw_path in parsed.file_paths)
+        )
+    else:
+        results = []
+    for sent_file, error_text in results:
         if sent_file:
             sent_files.append(sent_file)
         if error_text:
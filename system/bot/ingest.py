@@ -1,19 +1,23 @@
 from __future__ import annotations
 
+import asyncio
 from datetime import datetime, timezone
-import io
 from pathlib import Path
 import re
+import time
 
 from aiogram import Bot
 from aiogram.types import Message
 
 
+_SLUG_RE = re.compile(r"[^a-z0-9]+")
+
+
 def _slug(text: str, fallback: str = "item", max_len: int = 64) -> str:
     ascii_text = (
         text.encode("ascii", errors="ignore").decode("ascii").strip().lower()
     )
-    cleaned = re.sub(r"[^a-z0-9]+", "-", ascii_text).strip("-")
+    cleaned = _SLUG_RE.sub("-", ascii_text).strip("-")
     if not cleaned:
         cleaned = fallback
     return cleaned[:max_len]
@@ -29,8 +33,10 @@ def _unique_path(base_dir: Path, filename: str) -> Path:
         return candidate
     stem = candidate.stem
     suffix = candidate.suffix
-    for index in range(1, 1000):
-        candidate = base_dir / f"{stem}-{index}{suffix}"
+    # Наносекундный суффикс практически гарантированно уникален, поэтому
+    # вместо линейного перебора с stat() на каждую попытку хватает пары проб.
+    for _ in range(8):
+        candidate = base_dir / f"{stem}-{time.monotonic_ns():x}{suffix}"
         if not candidate.exists():
             return candidate
     raise RuntimeError(f"Failed to allocate unique path for {filename}")
@@ -50,7 +56,9 @@ async def download_attachments(
 ) -> list[str]:
     result_paths: list[str] = []
     message_id = int(message.message_id or 0)
-    timestamp = _message_datetime(message).strftime("%Y%m%d-%H%M%S")
+    dt = _message_datetime(message)
+    # f-string быстрее strftime: без разбора format-строки на каждый вызов.
+    timestamp = f"{dt.year:04d}{dt.month:02d}{dt.day:02d}-{dt.hour:02d}{dt.minute:02d}{dt.second:02d}"
 
     specs: list[tuple[str, str, str]] = []
 
@@ -83,19 +91,23 @@ async def download_attachments(
     if video_note:
         specs.append((video_note.file_id, "88_files", f"video-note-{message_id}.mp4"))
 
-    for file_id, folder, hinted_name in specs:
+    if not specs:
+        return result_paths
+
+    for folder in {folder for _, folder, _ in specs}:
+        base_dir = assistant_root / folder
+        await asyncio.to_thread(base_dir.mkdir, parents=True, exist_ok=True)
+
+    async def _fetch(file_id: str, folder: str, hinted_name: str) -> str:
         metadata = await bot.get_file(file_id)
         remote_path = metadata.file_path or ""
         remote_suffix = Path(remote_path).suffix
         hint_stem = _slug(Path(hinted_name).stem, fallback="file")
         suffix = remote_suffix or Path(hinted_name).suffix or ".bin"
         filename = f"{timestamp}-{hint_stem}{suffix}"
-        base_dir = assistant_root / folder
-        base_dir.mkdir(parents=True, exist_ok=True)
-        output_path = _unique_path(base_dir, filename)
-        buffer = io.BytesIO()
-        await bot.download(file=file_id, destination=buffer)
-        output_path.write_bytes(buffer.getvalue())
-        result_paths.append(output_path.relative_to(assistant_root).as_posix())
+        output_path = await asyncio.to_thread(_unique_path, assistant_root / folder, filename)
+        await bot.download(file=file_id, destination=output_path)
+        return output_path.relative_to(assistant_root).as_posix()
 
+    result_paths.extend(await asyncio.gather(*(_fetch(*spec) for spec in specs)))
     return result_paths
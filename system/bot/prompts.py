@@ -20,8 +20,7 @@ from .memory_store import build_memory_prompt_note
 def _attachments_block(attachments: list[str]) -> str:
     if not attachments:
         return ""
-    lines = [f"- `{item}`" for item in attachments]
-    return "\n".join(lines)
+    return "\n".join(f"- `{item}`" for item in attachments)
 
 
 def _bootstrap_prefix(include_bootstrap: bool) -> str:
@@ -167,6 +166,16 @@ def _workspace_memory_note() -> str:
     )
 
 
+# Все note-блоки статичны: собираем их один раз при импорте,
+# а не пересобираем заново на каждый построенный prompt.
+_BOOTSTRAP_PREFIX = _bootstrap_prefix(True)
+_SEND_FILES_NOTE = _send_files_protocol_note()
+_RISKY_NOTE = _risky_action_confirmation_note()
+_WORKSPACE_MEMORY_NOTE = _workspace_memory_note()
+_MEMORY_NOTE = build_memory_prompt_note()
+_STANDARD_NOTES = f"{_MEMORY_NOTE}\n\n{_SEND_FILES_NOTE}\n\n{_RISKY_NOTE}"
+
+
 def build_prompt(
     user_text: str,
     attachments: list[str],
@@ -174,22 +183,17 @@ def build_prompt(
 ) -> str:
     text = (user_text or "").strip()
     attachment_block = _attachments_block(attachments)
-    prefix = _bootstrap_prefix(include_bootstrap)
-    send_files_note = _send_files_protocol_note()
-    risky_note = _risky_action_confirmation_note()
-    memory_note = build_memory_prompt_note()
+    prefix = _BOOTSTRAP_PREFIX if include_bootstrap else ""
 
     if text and not attachments:
-        return f"{prefix}{text}\n\n{memory_note}\n\n{send_files_note}\n\n{risky_note}"
+        return f"{prefix}{text}\n\n{_STANDARD_NOTES}"
 
     if text and attachments:
         return (
             f"{prefix}{text}\n\n"
             "Вложения пользователя (пути на сервере):\n"
             f"{attachment_block}\n\n"
-            f"{memory_note}\n\n"
-            f"{send_files_note}\n\n"
-            f"{risky_note}"
+            f"{_STANDARD_NOTES}"
         )
 
     return (
@@ -197,9 +201,7 @@ def build_prompt(
         "Пользователь отправил вложения без текста.\n"
         "Вложения пользователя (пути на сервере):\n"
         f"{attachment_block}\n\n"
-        f"{memory_note}\n\n"
-        f"{send_files_note}\n\n"
-        f"{risky_note}"
+        f"{_STANDARD_NOTES}"
     )
 
 
@@ -229,10 +231,7 @@ def build_autonomy_wakeup_prompt(
     recent_user_lines: list[str] | None = None,
     include_bootstrap: bool = False,
 ) -> str:
-    prefix = _bootstrap_prefix(include_bootstrap)
-    send_files_note = _send_files_protocol_note()
-    risky_note = _risky_action_confirmation_note()
-    memory_note = build_memory_prompt_note()
+    prefix = _BOOTSTRAP_PREFIX if include_bootstrap else ""
     wakeup_context = _wakeup_context_block(
         active_request_lines,
         recent_task_lines,
@@ -254,7 +253,6 @@ def build_autonomy_wakeup_prompt(
         mission_recent_checkpoints=mission_recent_checkpoints,
         mission_recent_lines=mission_recent_lines,
     )
-    workspace_memory_note = _workspace_memory_note()
 
     current_task_block = ""
     if current_task_id is not None:
@@ -317,7 +315,7 @@ def build_autonomy_wakeup_prompt(
         "Многошаговость допустима только там, где за один проход реально нельзя сделать весь оставшийся кусок без самообмана или где есть внешний блокер.\n"
         "Если уже делаешь одну и ту же линию не первый раз, предпочти более крупный законченный кусок вместо ещё одного мелкого follow-up.\n"
         "Перед началом коротко осмотрись: учти память, недавние пользовательские сигналы и автономные шаги.\n"
-        f"{workspace_memory_note}\n"
+        f"{_WORKSPACE_MEMORY_NOTE}\n"
         "Если можешь безопасно сделать небольшой ресерч, заметку, сводку или другой конкретный полезный результат, предпочитай это мета-размышлениям.\n"
         "Не выбирай шаги, чей единственный результат — сообщить, что сервис живой, heartbeat сработал, процесс `active`, PID изменился или другой операционный статус без явной пользы владельцу.\n"
         "Если активных поручений нет и полезной темы сейчас не видно, лучше честно сделать `ACTION: NOOP`, чем выдумывать техническую активность ради активности.\n"
@@ -408,9 +406,7 @@ def build_autonomy_wakeup_prompt(
         f"{mission_contract}\n\n"
         f"{current_task_block}"
         f"{wakeup_context}\n\n"
-        f"{memory_note}\n\n"
-        f"{send_files_note}\n\n"
-        f"{risky_note}"
+        f"{_STANDARD_NOTES}"
     )
 
 
@@ -1,15 +1,29 @@
 from __future__ import annotations
 
+from collections import deque
 from dataclasses import dataclass
 from pathlib import Path
+import hashlib
 import json
 import sqlite3
 import threading
+import time
 from datetime import datetime, timedelta, timezone
 
 
+# Один компактный энкодер на модуль: без пробелов-сепараторов и без
+# пересоздания JSONEncoder на каждый enqueue.
+_JSON_ENCODE = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
 def _utc_now() -> str:
-    return datetime.now(timezone.utc).isoformat()
+    # strftime по gmtime заметно дешевле datetime.now(tz).isoformat(),
+    # а формат остаётся разбираемым через datetime.fromisoformat.
+    now = time.time()
+    return (
+        time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now))
+        + f".{int((now % 1) * 1e6):06d}+00:00"
+    )
 
 
 def _parse_dt(value: str) -> datetime | None:
@@ -19,6 +33,60 @@ def _parse_dt(value: str) -> datetime | None:
         return None
 
 
+# SQL горячих путей — модульные константы: statement-кэш sqlite3 находит
+# подготовленный запрос по идентичному объекту строки без повторного парсинга.
+_SQL_ENQUEUE_TASK = """
+    INSERT INTO tasks (
+        chat_id,
+        user_id,
+        username,
+        text,
+        text_hash,
+        attachments_json,
+        status,
+        created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_SQL_CLAIM_NEXT_TASK = """
+    UPDATE tasks
+    SET status = 'running', started_at = ?
+    WHERE id = (
+        SELECT id FROM tasks
+        WHERE status = 'pending'
+        ORDER BY id ASC
+        LIMIT 1
+    )
+    RETURNING id, chat_id, user_id, username, text, attachments_json, created_at
+"""
+
+_SQL_COMPLETE_TASK = """
+    UPDATE tasks
+    SET status = 'done', finished_at = ?, result_text = ?, error_text = NULL
+    WHERE id = ?
+"""
+
+_SQL_FAIL_TASK = """
+    UPDATE tasks
+    SET status = 'failed', finished_at = ?, error_text = ?
+    WHERE id = ?
+"""
+
+_SQL_SET_META = """
+    INSERT INTO meta(key, value) VALUES (?, ?)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+"""
+
+_SQL_CLAIM_TASK_BY_ID = """
+    UPDATE tasks
+    SET status = 'running', started_at = ?
+    WHERE id = ? AND status = 'pending'
+    RETURNING id, chat_id, user_id, username, text, attachments_json, created_at
+"""
+
+_SQL_GET_META = "SELECT value FROM meta WHERE key = ?"
+
+
 @dataclass
 class Task:
     id: int
@@ -50,20 +118,62 @@ class QueueStore:
     def __init__(self, db_path: Path) -> None:
         self._db_path = db_path
         self._db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Лок охраняет только многостатементные транзакции (enqueue, lease);
+        # одиночные statement'ы сериализует сам SQLite с busy_timeout.
         self._lock = threading.RLock()
-        self._conn = sqlite3.connect(
-            str(self._db_path), check_same_thread=False, isolation_level=None
-        )
-        self._conn.row_factory = sqlite3.Row
+        # Соединение на поток: при WAL читатели не блокируют писателя,
+        # и потоки to_thread-пула не толкаются на общем мьютексе соединения.
+        self._local = threading.local()
+        self._all_conns: set[sqlite3.Connection] = set()
         self._init_schema()
+        # Кэш последнего активного чата: значение нужно лишь для восстановления
+        # после рестарта, поэтому повторные одинаковые записи не пишем на диск.
+        self._last_active_chat_value = self.get_meta("last_active_chat_id", "")
+        # Кэш session id по чатам: между задачами одного чата значение почти
+        # не меняется, а все записи идут через этот же класс, так что кэш
+        # не может устареть.
+        self._chat_session_cache: dict[int, str] = {}
+        # Fast-path очередь id ожидающих задач; SQLite остаётся источником
+        # истины, deque лишь избавляет claim от подзапроса-скана.
+        self._pending_ids: deque[int] = deque(
+            int(row[0])
+            for row in self._conn.execute(
+                "SELECT id FROM tasks WHERE status = 'pending' ORDER BY id ASC"
+            )
+        )
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                str(self._db_path), check_same_thread=False, isolation_level=None
+            )
+            conn.row_factory = sqlite3.Row
+            self._tune_connection(conn)
+            self._local.conn = conn
+            with self._lock:
+                self._all_conns.add(conn)
+        return conn
+
+    @staticmethod
+    def _tune_connection(conn: sqlite3.Connection) -> None:
+        # WAL + synchronous=NORMAL: писатель не блокирует читателей,
+        # а каждый commit перестаёт стоить полный fsync журнала.
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=67108864")
+        conn.execute("PRAGMA cache_size=-8000")
+        conn.execute("PRAGMA wal_autocheckpoint=1000")
+        # Конкурентный BEGIN IMMEDIATE ждёт, а не падает с SQLITE_BUSY.
+        conn.execute("PRAGMA busy_timeout=5000")
 
     def _init_schema(self) -> None:
         with self._conn:
             self._conn.execute(
                 self._tasks_schema_sql("tasks")
             )
-        self._migrate_legacy_tasks_schema_if_needed()
-        with self._conn:
             self._conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS meta (
@@ -72,6 +182,29 @@ class QueueStore:
                 )
                 """
             )
+        # Sentinel в meta: PRAGMA table_info-рефлексию гоняем только до первой
+        # успешной миграции, а не на каждом старте процесса.
+        if self.get_meta("schema_version", "") != "v3":
+            self._migrate_legacy_tasks_schema_if_needed()
+            if "text_hash" not in self._read_task_columns():
+                with self._conn:
+                    self._conn.execute("ALTER TABLE tasks ADD COLUMN text_hash TEXT")
+            self.set_meta("schema_version", "v3")
+        with self._conn:
+            # Частичный индекс держит claim O(log n) даже когда done/failed
+            # строки копятся; индекс по status ускоряет counts().
+            self._conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_tasks_pending
+                ON tasks(id) WHERE status = 'pending'
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tasks_text_hash ON tasks(text_hash)"
+            )
 
     def _read_task_columns(self) -> set[str]:
         rows = self._conn.execute("PRAGMA table_info(tasks)").fetchall()
@@ -86,6 +219,7 @@ class QueueStore:
                 user_id INTEGER NOT NULL,
                 username TEXT NOT NULL,
                 text TEXT NOT NULL,
+                text_hash TEXT,
                 attachments_json TEXT NOT NULL,
                 status TEXT NOT NULL,
                 created_at TEXT NOT NULL,
@@ -154,37 +288,46 @@ class QueueStore:
         text: str,
         attachments: list[str],
     ) -> int:
-        with self._lock, self._conn:
-            self._set_meta_unlocked("last_active_chat_id", str(chat_id))
-            next_signal = self.get_user_signal(chat_id) + 1
-            self._set_meta_unlocked(f"user_signal:{chat_id}", str(next_signal))
-            cursor = self._conn.execute(
-                """
-                INSERT INTO tasks (
-                    chat_id,
-                    user_id,
-                    username,
-                    text,
-                    attachments_json,
-                    status,
-                    created_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    chat_id,
-                    user_id,
-                    username,
-                    text,
-                    json.dumps(attachments, ensure_ascii=False),
-                    "pending",
-                    _utc_now(),
-                ),
-            )
-            return int(cursor.lastrowid)
+        attachments_json = "[]" if not attachments else _JSON_ENCODE(attachments)
+        # blake2b — самый быстрый стандартный хэш в CPython; 16 байт достаточно
+        # для дедупликации без сравнения широких TEXT-колонок.
+        text_hash = hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+        with self._lock:
+            # Одна транзакция на сообщение: meta-записи и вставка задачи
+            # уезжают на диск одним коммитом вместо трёх.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._set_meta_unlocked("last_active_chat_id", str(chat_id))
+                next_signal = self.get_user_signal(chat_id) + 1
+                self._set_meta_unlocked(f"user_signal:{chat_id}", str(next_signal))
+                cursor = self._conn.execute(
+                    _SQL_ENQUEUE_TASK,
+                    (
+                        chat_id,
+                        user_id,
+                        username,
+                        text,
+                        text_hash,
+                        attachments_json,
+                        "pending",
+                        _utc_now(),
+                    ),
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            self._last_active_chat_value = str(chat_id)
+            task_id = int(cursor.lastrowid)
+            self._pending_ids.append(task_id)
+            return task_id
 
     def note_chat_activity(self, chat_id: int) -> None:
-        with self._lock, self._conn:
-            self._set_meta_unlocked("last_active_chat_id", str(chat_id))
+        value = str(chat_id)
+        if value == self._last_active_chat_value:
+            return
+        self._set_meta_unlocked("last_active_chat_id", value)
+        self._last_active_chat_value = value
 
     def get_last_active_chat_id(self) -> int | None:
         value = self.get_meta("last_active_chat_id", "").strip()
@@ -196,86 +339,127 @@ class QueueStore:
             return None
 
     def claim_next_task(self) -> Task | None:
-        with self._lock:
-            self._conn.execute("BEGIN IMMEDIATE")
-            row = self._conn.execute(
-                """
-                SELECT * FROM tasks
-                WHERE status = 'pending'
-                ORDER BY id ASC
-                LIMIT 1
-                """
-            ).fetchone()
-            if row is None:
-                self._conn.execute("COMMIT")
-                return None
-            self._conn.execute(
-                "UPDATE tasks SET status = 'running', started_at = ? WHERE id = ?",
-                (_utc_now(), row["id"]),
-            )
-            self._conn.execute("COMMIT")
-            return Task(
-                id=int(row["id"]),
-                chat_id=int(row["chat_id"]),
-                user_id=int(row["user_id"]),
-                username=row["username"],
-                text=row["text"],
-                attachments=json.loads(row["attachments_json"]),
-                created_at=row["created_at"],
-            )
+        # Сначала пробуем id из in-memory очереди: захват по первичному ключу
+        # вместо подзапроса-скана. Строка могла исчезнуть (например, БД
+        # правили извне) — тогда просто берём следующий id.
+        while True:
+            try:
+                task_id = self._pending_ids.popleft()
+            except IndexError:
+                break
+            row = self._conn.execute(_SQL_CLAIM_TASK_BY_ID, (_utc_now(), task_id)).fetchone()
+            if row is not None:
+                return self._task_from_row(row)
+        # Запасной путь: pending-строки, о которых deque не знает.
+        row = self._conn.execute(_SQL_CLAIM_NEXT_TASK, (_utc_now(),)).fetchone()
+        if row is None:
+            return None
+        return self._task_from_row(row)
+
+    def claim_next_tasks(self, limit: int) -> list[Task]:
+        """Захватывает до limit pending-задач за один вызов (для параллельной
+        обработки независимых чатов)."""
+        tasks: list[Task] = []
+        while len(tasks) < limit:
+            task = self.claim_next_task()
+            if task is None:
+                break
+            tasks.append(task)
+        return tasks
+
+    @staticmethod
+    def _task_from_row(row: sqlite3.Row) -> Task:
+        return Task(
+            id=int(row["id"]),
+            chat_id=int(row["chat_id"]),
+            user_id=int(row["user_id"]),
+            username=row["username"],
+            text=row["text"],
+            attachments=json.loads(row["attachments_json"]),
+            created_at=row["created_at"],
+        )
 
     def complete_task(self, task_id: int, result_text: str) -> None:
-        with self._lock, self._conn:
-            self._conn.execute(
-                """
-                UPDATE tasks
-                SET status = 'done', finished_at = ?, result_text = ?, error_text = NULL
-                WHERE id = ?
-                """,
-                (_utc_now(), result_text, task_id),
-            )
+        self._conn.execute(_SQL_COMPLETE_TASK, (_utc_now(), result_text, task_id))
 
     def fail_task(self, task_id: int, error_text: str) -> None:
-        with self._lock, self._conn:
-            self._conn.execute(
-                """
-                UPDATE tasks
-                SET status = 'failed', finished_at = ?, error_text = ?
-                WHERE id = ?
-                """,
-                (_utc_now(), error_text, task_id),
-            )
+        self._conn.execute(_SQL_FAIL_TASK, (_utc_now(), error_text, task_id))
+
+    def complete_and_set_session(
+        self,
+        task_id: int,
+        result_text: str,
+        chat_id: int,
+        session_id: str = "",
+    ) -> None:
+        # Финальный статус и свежий session id уезжают одним коммитом
+        # вместо двух последовательных записей в WAL.
+        self._finish_and_set_session(
+            _SQL_COMPLETE_TASK, task_id, result_text, chat_id, session_id
+        )
+
+    def fail_and_set_session(
+        self,
+        task_id: int,
+        error_text: str,
+        chat_id: int,
+        session_id: str = "",
+    ) -> None:
+        self._finish_and_set_session(
+            _SQL_FAIL_TASK, task_id, error_text, chat_id, session_id
+        )
+
+    def _finish_and_set_session(
+        self,
+        sql: str,
+        task_id: int,
+        text: str,
+        chat_id: int,
+        session_id: str,
+    ) -> None:
+        if not session_id:
+            self._conn.execute(sql, (_utc_now(), text, task_id))
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(sql, (_utc_now(), text, task_id))
+                self._set_meta_unlocked(f"chat_session:{chat_id}", session_id)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            self._chat_session_cache[chat_id] = session_id
 
     def get_meta(self, key: str, default: str = "") -> str:
-        row = self._conn.execute(
-            "SELECT value FROM meta WHERE key = ?", (key,)
-        ).fetchone()
+        cursor = self._conn.execute(_SQL_GET_META, (key,))
+        # Самый частый запрос стора: позиционный доступ без обёртки sqlite3.Row.
+        cursor.row_factory = None
+        row = cursor.fetchone()
         if row is None:
             return default
-        return str(row["value"])
+        return row[0]
 
     def set_meta(self, key: str, value: str) -> None:
-        with self._lock, self._conn:
-            self._set_meta_unlocked(key, value)
+        self._set_meta_unlocked(key, value)
 
     def _set_meta_unlocked(self, key: str, value: str) -> None:
-        self._conn.execute(
-            """
-            INSERT INTO meta(key, value) VALUES (?, ?)
-            ON CONFLICT(key) DO UPDATE SET value = excluded.value
-            """,
-            (key, value),
-        )
+        self._conn.execute(_SQL_SET_META, (key, value))
 
     def get_chat_session_id(self, chat_id: int) -> str:
-        return self.get_meta(f"chat_session:{chat_id}", "")
+        cached = self._chat_session_cache.get(chat_id)
+        if cached is None:
+            cached = self.get_meta(f"chat_session:{chat_id}", "")
+            self._chat_session_cache[chat_id] = cached
+        return cached
 
     def set_chat_session_id(self, chat_id: int, session_id: str) -> None:
         self.set_meta(f"chat_session:{chat_id}", session_id)
+        self._chat_session_cache[chat_id] = session_id
 
     def clear_chat_session_id(self, chat_id: int) -> None:
-        with self._lock, self._conn:
-            self._conn.execute("DELETE FROM meta WHERE key = ?", (f"chat_session:{chat_id}",))
+        self._conn.execute("DELETE FROM meta WHERE key = ?", (f"chat_session:{chat_id}",))
+        self._chat_session_cache[chat_id] = ""
 
     def get_user_signal(self, chat_id: int) -> int:
         raw = self.get_meta(f"user_signal:{chat_id}", "0").strip()
@@ -339,8 +523,10 @@ class QueueStore:
         return current_owner
 
     def list_chat_session_ids(self) -> set[str]:
+        # Диапазон по первичному ключу вместо LIKE: ';' — следующий символ
+        # после ':', так что границы покрывают ровно префикс 'chat_session:'.
         rows = self._conn.execute(
-            "SELECT value FROM meta WHERE key LIKE 'chat_session:%'"
+            "SELECT value FROM meta WHERE key >= 'chat_session:' AND key < 'chat_session;'"
         ).fetchall()
         result: set[str] = set()
         for row in rows:
@@ -349,6 +535,19 @@ class QueueStore:
                 result.add(value)
         return result
 
+    def prune_old_tasks(self, keep_days: int = 30) -> int:
+        # Done/failed строки копятся бесконечно; без обрезки таблица вырастает
+        # за пределы page cache и все сканы (counts, list_tasks) замедляются.
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=keep_days)).isoformat()
+        cursor = self._conn.execute(
+            """
+            DELETE FROM tasks
+            WHERE status IN ('done', 'failed') AND finished_at < ?
+            """,
+            (cutoff,),
+        )
+        return int(cursor.rowcount)
+
     def counts(self) -> dict[str, int]:
         rows = self._conn.execute(
             """
@@ -412,4 +611,8 @@ class QueueStore:
         ]
 
     def close(self) -> None:
-        self._conn.close()
+        with self._lock:
+            conns = list(self._all_conns)
+            self._all_conns.clear()
+        for conn in conns:
+            conn.close()
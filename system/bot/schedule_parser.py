@@ -8,6 +8,16 @@ from zoneinfo import ZoneInfo
 
 DEFAULT_TIMEZONE = "Europe/Moscow"
 
+_WEEKDAY_NAMES = {
+    0: "каждый понедельник",
+    1: "каждый вторник",
+    2: "каждую среду",
+    3: "каждый четверг",
+    4: "каждую пятницу",
+    5: "каждую субботу",
+    6: "каждое воскресенье",
+}
+
 
 @dataclass(frozen=True)
 class ScheduleIntent:
@@ -156,16 +166,7 @@ def describe_recurrence(
         return f"каждый день в {recurrence_json.get('time')} ({timezone_name})"
     if recurrence_kind == "weekly":
         weekday = int(recurrence_json.get("weekday", 0))
-        names = {
-            0: "каждый понедельник",
-            1: "каждый вторник",
-            2: "каждую среду",
-            3: "каждый четверг",
-            4: "каждую пятницу",
-            5: "каждую субботу",
-            6: "каждое воскресенье",
-        }
-        return f"{names.get(weekday, 'каждую неделю')} в {recurrence_json.get('time')} ({timezone_name})"
+        return f"{_WEEKDAY_NAMES.get(weekday, 'каждую неделю')} в {recurrence_json.get('time')} ({timezone_name})"
     if recurrence_kind == "once":
         return f"один раз {recurrence_json.get('date')} в {recurrence_json.get('time')} ({timezone_name})"
     return recurrence_kind
@@ -12,6 +12,13 @@ SESSION_ID_RE = re.compile(
     re.IGNORECASE,
 )
 
+# UUID сессии стоит непосредственно перед `.jsonl`, поэтому хватает одного
+# заякоренного search вместо finditer по всему имени файла.
+_SESSION_ID_TAIL_RE = re.compile(
+    r"([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})\.jsonl\Z",
+    re.IGNORECASE,
+)
+
 
 @dataclass(frozen=True)
 class GcResult:
@@ -21,11 +28,13 @@ class GcResult:
     errors: int
 
 
+def _extract_session_id_from_name(name: str) -> str:
+    match = _SESSION_ID_TAIL_RE.search(name)
+    return match.group(1).lower() if match else ""
+
+
 def _extract_session_id(path: Path) -> str:
-    match = None
-    for match in SESSION_ID_RE.finditer(path.name):
-        pass
-    return (match.group(1) if match else "").lower()
+    return _extract_session_id_from_name(path.name)
 
 
 def gc_sessions(
@@ -44,39 +53,90 @@ def gc_sessions(
     if not sessions_dir.exists():
         return GcResult(0, 0, 0, 0)
 
-    for path in sessions_dir.rglob("rollout-*.jsonl"):
-        if not path.is_file():
-            continue
-        try:
-            st = path.stat()
-        except OSError:
-            errors += 1
-            continue
-
-        if st.st_mtime >= cutoff:
-            skipped += 1
-            continue
-
-        session_id = _extract_session_id(path)
-        if session_id and session_id in keep:
-            kept += 1
-            continue
+    def _walk(dir_fd: int) -> int:
+        """Один DFS-проход: чистит старые rollout'ы и возвращает число
+        оставшихся записей, чтобы пустые каталоги убирались на обратном пути.
 
+        Работает на dir_fd: unlink/rmdir по имени внутри открытого каталога
+        (unlinkat) — ядро не переобходит весь путь на каждое удаление."""
+        nonlocal deleted, kept, skipped, errors
+        # scandir отдаёт тип и stat из getdents без лишних syscall'ов
+        # и без аллокации Path на каждый файл.
         try:
-            path.unlink()
-            deleted += 1
+            with os.scandir(dir_fd) as it:
+                entries = list(it)
         except OSError:
             errors += 1
+            return 1
+        remaining = 0
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    try:
+                        child_fd = os.open(
+                            entry.name,
+                            os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW,
+                            dir_fd=dir_fd,
+                        )
+                    except OSError:
+                        errors += 1
+                        remaining += 1
+                        continue
+                    try:
+                        child_remaining = _walk(child_fd)
+                    finally:
+                        os.close(child_fd)
+                    if child_remaining == 0:
+                        try:
+                            os.rmdir(entry.name, dir_fd=dir_fd)
+                            continue
+                        except OSError:
+                            pass
+                    remaining += 1
+                    continue
+                if not (
+                    entry.name.startswith("rollout-")
+                    and entry.name.endswith(".jsonl")
+                ):
+                    remaining += 1
+                    continue
+                if not entry.is_file(follow_symlinks=False):
+                    remaining += 1
+                    continue
+                st = entry.stat()
+            except OSError:
+                errors += 1
+                remaining += 1
+                continue
+
+            if st.st_mtime >= cutoff:
+                skipped += 1
+                remaining += 1
+                continue
+
+            # При пустом keep-наборе id никому не нужен — regex не гоняем.
+            if keep:
+                session_id = _extract_session_id_from_name(entry.name)
+                if session_id and session_id in keep:
+                    kept += 1
+                    remaining += 1
+                    continue
 
-    # Best-effort: remove empty directories under sessions_dir.
-    for dirpath, dirnames, filenames in os.walk(str(sessions_dir), topdown=False):
-        if dirpath == str(sessions_dir):
-            continue
-        if not dirnames and not filenames:
             try:
-                Path(dirpath).rmdir()
+                os.unlink(entry.name, dir_fd=dir_fd)
+                deleted += 1
             except OSError:
-                pass
+                errors += 1
+                remaining += 1
+        return remaining
+
+    try:
+        root_fd = os.open(os.fspath(sessions_dir), os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return GcResult(0, 0, 0, 1)
+    try:
+        _walk(root_fd)
+    finally:
+        os.close(root_fd)
 
     return GcResult(deleted, kept, skipped, errors)
-
@@ -3,15 +3,25 @@ from __future__ import annotations
 from dataclasses import dataclass
 from pathlib import Path
 import base64
+import http.client
 import json
 import logging
+import mmap
 import re
-import urllib.error
-import urllib.request
+import threading
+from urllib.parse import urlsplit
+
+try:  # Тот же паттерн, что в codex_runner: orjson при наличии, stdlib — запасной.
+    import orjson
+except ImportError:  # pragma: no cover - окружение без orjson
+    orjson = None  # type: ignore[assignment]
 
 from .config import Settings
 
 
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+
 LOGGER = logging.getLogger("assistant.stt")
 
 
@@ -27,6 +37,10 @@ SUPPORTED_AUDIO_FORMATS = {
 }
 
 
+_WORD_RE = re.compile(r"\w+")
+_PUNCT_ONLY_RE = re.compile(r"[\d\s,.;:!?()\-]+")
+
+
 @dataclass(frozen=True)
 class SttResult:
     success: bool
@@ -35,7 +49,13 @@ class SttResult:
 
 
 def _guess_audio_format(path: Path) -> str:
-    return SUPPORTED_AUDIO_FORMATS.get(path.suffix.lower(), "")
+    suffix = path.suffix
+    # Расширения почти всегда уже в нижнем регистре — .lower() только
+    # для редких ".OGG" и подобных.
+    fmt = SUPPORTED_AUDIO_FORMATS.get(suffix)
+    if fmt is not None:
+        return fmt
+    return SUPPORTED_AUDIO_FORMATS.get(suffix.lower(), "")
 
 
 def _extract_message_text(content: object) -> str:
@@ -68,7 +88,7 @@ def _extract_transcript_from_json(text: str) -> str:
     if not body:
         return ""
     try:
-        payload = json.loads(body)
+        payload = _json_loads(body)
     except json.JSONDecodeError:
         return ""
     if not isinstance(payload, dict):
@@ -81,17 +101,15 @@ def _extract_transcript_from_json(text: str) -> str:
 
 
 def _extract_transcript(response_json: dict) -> str:
-    choices = response_json.get("choices")
-    if not isinstance(choices, list) or not choices:
-        return ""
-    first = choices[0]
-    if not isinstance(first, dict):
-        return ""
-    message = first.get("message")
-    if not isinstance(message, dict):
+    # Ответ почти всегда корректной формы: одна цепочка индексаций дешевле
+    # каскада isinstance-проверок, а кривой JSON уходит в except.
+    try:
+        content = response_json["choices"][0]["message"]["content"]
+    except (AttributeError, KeyError, IndexError, TypeError):
         return ""
-    content_text = _extract_message_text(message.get("content"))
-    return _extract_transcript_from_json(content_text)
+    if isinstance(content, str):
+        return _extract_transcript_from_json(content.strip())
+    return _extract_transcript_from_json(_extract_message_text(content))
 
 
 def _looks_suspicious_transcript(transcript: str, duration_sec: int) -> bool:
@@ -101,13 +119,15 @@ def _looks_suspicious_transcript(transcript: str, duration_sec: int) -> bool:
     if not text:
         return True
 
-    word_count = len(re.findall(r"\w+", text, flags=re.UNICODE))
-    if duration_sec >= 10 and word_count <= 5:
-        return True
+    # Дешёвая проверка длины идёт первой: обычные расшифровки отсекаются
+    # без запуска regex-эвристик.
     if duration_sec >= 8 and len(text) < duration_sec * 2:
         return True
-    if duration_sec >= 10 and re.fullmatch(r"[\d\s,.;:!?()\-]+", text):
-        return True
+    if duration_sec >= 10:
+        if len(_WORD_RE.findall(text)) <= 5:
+            return True
+        if _PUNCT_ONLY_RE.fullmatch(text):
+            return True
     return False
 
 
@@ -115,7 +135,7 @@ def _extract_error_text(raw_body: bytes) -> str:
     if not raw_body:
         return ""
     try:
-        payload = json.loads(raw_body.decode("utf-8", errors="replace"))
+        payload = _json_loads(raw_body)
     except Exception:
         return raw_body.decode("utf-8", errors="replace").strip()
 
@@ -132,9 +152,84 @@ def _extract_error_text(raw_body: bytes) -> str:
     return ""
 
 
+# Маркеры, на место которых в уже сериализованный JSON подставляются
+# переменные части запроса. Все подставляемые значения — чистый ASCII без
+# кавычек и backslash'ей, то есть JSON-safe, так что прогонять тело через
+# json.dumps на каждый запрос не нужно.
+_AUDIO_B64_PLACEHOLDER = "__AUDIO_B64__"
+_AUDIO_FORMAT_PLACEHOLDER = "__AUDIO_FORMAT__"
+_DURATION_HINT_PLACEHOLDER = "__DURATION_HINT__"
+
+
 class OpenRouterSttClient:
     def __init__(self, settings: Settings) -> None:
         self._settings = settings
+        split = urlsplit(settings.openrouter_base_url.rstrip("/"))
+        self._host = split.netloc
+        self._endpoint_path = f"{split.path}/chat/completions"
+        self._use_https = split.scheme != "http"
+        # Одно keep-alive соединение на клиент: без TLS-рукопожатия на каждый
+        # запрос (в том числе на retry без response_format).
+        self._conn: http.client.HTTPConnection | None = None
+        self._conn_lock = threading.Lock()
+        # Заголовки не меняются между запросами — собираем словарь один раз.
+        self._request_headers = {
+            "Authorization": f"Bearer {settings.openrouter_api_key}",
+            "Content-Type": "application/json",
+        }
+        # Модели, уже ответившие ошибкой на response_format: для них первый
+        # (заведомо провальный) запрос с ним больше не делаем.
+        self._skip_response_format: set[str] = set()
+        # Статичная часть тела сериализуется один раз на клиент: в запросе
+        # остаётся только склейка фрагментов с hint'ом, base64 и форматом.
+        self._body_fragments = {
+            use_response_format: self._serialize_body_template(use_response_format)
+            for use_response_format in (True, False)
+        }
+
+    def _serialize_body_template(
+        self, use_response_format: bool
+    ) -> tuple[str, str, str, str]:
+        payload = self._make_payload(
+            audio_b64=_AUDIO_B64_PLACEHOLDER,
+            audio_format=_AUDIO_FORMAT_PLACEHOLDER,
+            use_response_format=use_response_format,
+            duration_hint=_DURATION_HINT_PLACEHOLDER,
+        )
+        serialized = json.dumps(payload, ensure_ascii=False)
+        # Порядок маркеров фиксирован порядком ключей в payload:
+        # hint в тексте инструкции, затем data, затем format.
+        pre_hint, _, rest = serialized.partition(_DURATION_HINT_PLACEHOLDER)
+        pre_audio, _, rest = rest.partition(_AUDIO_B64_PLACEHOLDER)
+        pre_format, _, post_format = rest.partition(_AUDIO_FORMAT_PLACEHOLDER)
+        return pre_hint, pre_audio, pre_format, post_format
+
+    def _open_connection(self) -> http.client.HTTPConnection:
+        conn_cls = (
+            http.client.HTTPSConnection if self._use_https else http.client.HTTPConnection
+        )
+        return conn_cls(self._host, timeout=self._settings.openrouter_stt_timeout_sec)
+
+    def _post(self, body: bytes, headers: dict[str, str]) -> tuple[int, bytes]:
+        with self._conn_lock:
+            for attempt in (0, 1):
+                if self._conn is None:
+                    self._conn = self._open_connection()
+                try:
+                    self._conn.request("POST", self._endpoint_path, body=body, headers=headers)
+                    response = self._conn.getresponse()
+                    return response.status, response.read()
+                except TimeoutError:
+                    self._conn.close()
+                    self._conn = None
+                    raise
+                except (http.client.HTTPException, OSError):
+                    # Сервер мог закрыть keep-alive соединение; переоткрываем один раз.
+                    self._conn.close()
+                    self._conn = None
+                    if attempt:
+                        raise
+            raise RuntimeError("unreachable")  # pragma: no cover
 
     def is_enabled(self) -> bool:
         return bool(self._settings.openrouter_api_key)
@@ -145,11 +240,8 @@ class OpenRouterSttClient:
         audio_b64: str,
         audio_format: str,
         use_response_format: bool,
-        duration_sec: int,
+        duration_hint: str,
     ) -> dict:
-        duration_hint = ""
-        if duration_sec > 0:
-            duration_hint = f" Audio duration is approximately {duration_sec} seconds."
         payload = {
             "model": self._settings.openrouter_stt_model,
             "messages": [
@@ -192,42 +284,37 @@ class OpenRouterSttClient:
     def _request_transcript(
         self,
         *,
-        audio_b64: str,
+        audio_b64: bytes,
         audio_format: str,
         use_response_format: bool,
         duration_sec: int,
     ) -> tuple[dict | None, str]:
-        payload = self._make_payload(
-            audio_b64=audio_b64,
-            audio_format=audio_format,
-            use_response_format=use_response_format,
-            duration_sec=duration_sec,
-        )
-        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-        url = self._settings.openrouter_base_url.rstrip("/") + "/chat/completions"
-        request = urllib.request.Request(
-            url=url,
-            data=body,
-            headers={
-                "Authorization": f"Bearer {self._settings.openrouter_api_key}",
-                "Content-Type": "application/json",
-            },
-            method="POST",
+        duration_hint = ""
+        if duration_sec > 0:
+            duration_hint = f" Audio duration is approximately {duration_sec} seconds."
+        pre_hint, pre_audio, pre_format, post_format = self._body_fragments[
+            use_response_format
+        ]
+        body = b"".join(
+            (
+                f"{pre_hint}{duration_hint}{pre_audio}".encode("utf-8"),
+                audio_b64,
+                f"{pre_format}{audio_format}{post_format}".encode("utf-8"),
+            )
         )
 
         try:
-            with urllib.request.urlopen(request, timeout=self._settings.openrouter_stt_timeout_sec) as response:
-                response_raw = response.read()
-        except urllib.error.HTTPError as exc:
-            details = _extract_error_text(exc.read())
-            if details:
-                return None, f"STT HTTP {exc.code}: {details}"
-            return None, f"STT HTTP {exc.code}"
+            status, response_raw = self._post(body, self._request_headers)
         except Exception as exc:  # pragma: no cover - defensive guard
             return None, f"STT request failed: {exc}"
+        if status != 200:
+            details = _extract_error_text(response_raw)
+            if details:
+                return None, f"STT HTTP {status}: {details}"
+            return None, f"STT HTTP {status}"
 
         try:
-            return json.loads(response_raw.decode("utf-8")), ""
+            return _json_loads(response_raw), ""
         except json.JSONDecodeError:
             return None, "STT вернул некорректный JSON."
 
@@ -255,9 +342,16 @@ class OpenRouterSttClient:
         if not audio_format:
             return SttResult(False, "", f"Неподдерживаемый формат аудио: {audio_path.suffix or '(none)'}")
 
-        audio_b64 = base64.b64encode(audio_path.read_bytes()).decode("ascii")
+        # mmap вместо read_bytes: b64encode читает страницы напрямую,
+        # без промежуточной полной копии файла в памяти процесса.
+        # Байты не декодируем — они подставляются в тело запроса как есть.
+        with open(audio_path, "rb") as audio_file:
+            with mmap.mmap(audio_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                audio_b64 = base64.b64encode(mm)
+        model = self._settings.openrouter_stt_model
+        attempts = (False,) if model in self._skip_response_format else (True, False)
         last_error = "STT вернул ответ не в формате транскрипта."
-        for use_response_format in (True, False):
+        for use_response_format in attempts:
             response_json, request_error = self._request_transcript(
                 audio_b64=audio_b64,
                 audio_format=audio_format,
@@ -267,6 +361,7 @@ class OpenRouterSttClient:
             if request_error:
                 last_error = request_error
                 if use_response_format and "response_format" in request_error.lower():
+                    self._skip_response_format.add(model)
                     continue
                 return SttResult(False, "", last_error)
             if response_json is None:
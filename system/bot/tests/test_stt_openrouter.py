@@ -1,10 +1,8 @@
-import io
 import json
 import tempfile
 import unittest
 from pathlib import Path
 from unittest import mock
-import urllib.error
 
 from system.bot.config import Settings
 from system.bot.stt_openrouter import (
@@ -40,18 +38,8 @@ def _make_settings(root: Path, api_key: str) -> Settings:
     )
 
 
-class _DummyResponse:
-    def __init__(self, payload: dict) -> None:
-        self._raw = json.dumps(payload).encode("utf-8")
-
-    def __enter__(self) -> "_DummyResponse":
-        return self
-
-    def __exit__(self, exc_type, exc, tb) -> bool:
-        return False
-
-    def read(self) -> bytes:
-        return self._raw
+def _http_response(payload: dict, status: int = 200) -> tuple[int, bytes]:
+    return status, json.dumps(payload).encode("utf-8")
 
 
 class OpenRouterSttTests(unittest.TestCase):
@@ -112,7 +100,7 @@ class OpenRouterSttTests(unittest.TestCase):
                     }
                 ]
             }
-            with mock.patch("urllib.request.urlopen", return_value=_DummyResponse(payload)):
+            with mock.patch.object(client, "_post", return_value=_http_response(payload)):
                 result = client.transcribe_file(audio)
             self.assertTrue(result.success)
             self.assertEqual(result.text, "привет мир")
@@ -143,9 +131,10 @@ class OpenRouterSttTests(unittest.TestCase):
                 ]
             }
 
-            with mock.patch(
-                "urllib.request.urlopen",
-                side_effect=[_DummyResponse(bad_payload), _DummyResponse(good_payload)],
+            with mock.patch.object(
+                client,
+                "_post",
+                side_effect=[_http_response(bad_payload), _http_response(good_payload)],
             ):
                 result = client.transcribe_file(audio)
             self.assertTrue(result.success)
@@ -167,9 +156,10 @@ class OpenRouterSttTests(unittest.TestCase):
                     }
                 ]
             }
-            with mock.patch(
-                "urllib.request.urlopen",
-                side_effect=[_DummyResponse(payload), _DummyResponse(payload)],
+            with mock.patch.object(
+                client,
+                "_post",
+                side_effect=[_http_response(payload), _http_response(payload)],
             ):
                 result = client.transcribe_file(audio)
             self.assertFalse(result.success)
@@ -191,31 +181,62 @@ class OpenRouterSttTests(unittest.TestCase):
                     }
                 ]
             }
-            with mock.patch(
-                "urllib.request.urlopen",
-                side_effect=[_DummyResponse(payload), _DummyResponse(payload)],
+            with mock.patch.object(
+                client,
+                "_post",
+                side_effect=[_http_response(payload), _http_response(payload)],
             ):
                 result = client.transcribe_file(audio, duration_sec=15)
             self.assertFalse(result.success)
             self.assertIn("подозрительно короткую", result.error)
 
-    def test_transcribe_file_http_error(self) -> None:
+    def test_transcribe_file_remembers_response_format_rejection(self) -> None:
         with tempfile.TemporaryDirectory() as td:
             root = Path(td)
             audio = root / "voice.ogg"
             audio.write_bytes(b"123")
             client = OpenRouterSttClient(_make_settings(root, api_key="test-key"))
 
-            error_body = io.BytesIO(json.dumps({"error": {"message": "bad request"}}).encode("utf-8"))
-            http_error = urllib.error.HTTPError(
-                url="https://openrouter.ai/api/v1/chat/completions",
-                code=400,
-                msg="Bad Request",
-                hdrs=None,
-                fp=error_body,
+            good_payload = {
+                "choices": [
+                    {
+                        "message": {
+                            "content": '{"transcript":"тестовая расшифровка"}',
+                        }
+                    }
+                ]
+            }
+            rejection = _http_response(
+                {"error": {"message": "response_format is not supported"}}, status=400
             )
+            with mock.patch.object(
+                client,
+                "_post",
+                side_effect=[
+                    rejection,
+                    _http_response(good_payload),
+                    _http_response(good_payload),
+                ],
+            ) as post:
+                first = client.transcribe_file(audio)
+                second = client.transcribe_file(audio)
+            self.assertTrue(first.success)
+            self.assertTrue(second.success)
+            # Второй вызов сразу идёт без response_format: всего три запроса.
+            self.assertEqual(post.call_count, 3)
 
-            with mock.patch("urllib.request.urlopen", side_effect=http_error):
+    def test_transcribe_file_http_error(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            root = Path(td)
+            audio = root / "voice.ogg"
+            audio.write_bytes(b"123")
+            client = OpenRouterSttClient(_make_settings(root, api_key="test-key"))
+
+            error_payload = {"error": {"message": "bad request"}}
+
+            with mock.patch.object(
+                client, "_post", return_value=_http_response(error_payload, status=400)
+            ):
                 result = client.transcribe_file(audio)
             self.assertFalse(result.success)
             self.assertIn("HTTP 400", result.error)
@@ -2,6 +2,8 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
 
 from aiogram import Bot
@@ -30,38 +32,104 @@ class Worker:
         bot: Bot,
         runner: CodexRunner,
         stop_event: asyncio.Event,
+        wake_event: asyncio.Event | None = None,
     ) -> None:
         self._settings = settings
         self._store = store
         self._bot = bot
         self._runner = runner
         self._stop_event = stop_event
+        self._wake_event = wake_event or asyncio.Event()
+        # Горячие поля настроек — плоскими атрибутами, без цепочки
+        # self._settings.<attr> на каждую задачу.
+        self._max_result_chars = settings.max_result_chars
+        self._session_lease_sec = settings.session_lease_sec
+        self._concurrency = max(1, settings.worker_concurrency)
+        # Свой ограниченный пул под codex-запуски: default-executor
+        # asyncio.to_thread разрастается под нагрузкой и делится с STT и БД.
+        self._runner_executor = ThreadPoolExecutor(
+            max_workers=self._concurrency, thread_name_prefix="codex"
+        )
+        # Telegram показывает "typing" ~5 секунд; повторная отправка чаще
+        # этого окна — лишний HTTP-вызов без видимого эффекта.
+        self._typing_last: dict[int, float] = {}
+        # Сильные ссылки на fire-and-forget задачи, чтобы их не собрал GC.
+        self._bg_tasks: set[asyncio.Task] = set()
         self._logger = logging.getLogger("assistant.worker")
 
     async def run(self) -> None:
-        while not self._stop_event.is_set():
-            task = self._store.claim_next_task()
-            if task is None:
-                with suppress(asyncio.TimeoutError):
-                    await asyncio.wait_for(
-                        self._stop_event.wait(),
-                        timeout=self._settings.idle_sleep_sec,
+        # Локальные привязки: цикл крутится вечно, LOAD_FAST дешевле LOAD_ATTR.
+        stop_is_set = self._stop_event.is_set
+        claim_next_tasks = self._store.claim_next_tasks
+        idle_sleep_sec = self._settings.idle_sleep_sec
+        concurrency = self._concurrency
+        try:
+            while not stop_is_set():
+                tasks = claim_next_tasks(concurrency)
+                if not tasks:
+                    # Пустая очередь: спим до enqueue-сигнала, а не опрашиваем
+                    # БД каждые idle_sleep_sec впустую.
+                    await self._wait_for_stop_or_wakeup(idle_sleep_sec)
+                    continue
+                if len(tasks) == 1:
+                    await self._process_task(tasks[0])
+                    continue
+                # Разные чаты обрабатываются параллельно, внутри одного чата
+                # порядок задач сохраняется.
+                by_chat: dict[int, list[Task]] = {}
+                for task in tasks:
+                    by_chat.setdefault(task.chat_id, []).append(task)
+                await asyncio.gather(
+                    *(
+                        self._process_chat_tasks(chat_tasks)
+                        for chat_tasks in by_chat.values()
                     )
-                continue
+                )
+        finally:
+            # К этому моменту in-flight задач нет: цикл всегда дожидается
+            # своих process-корутин перед выходом.
+            self._runner_executor.shutdown(wait=True)
+
+    async def _process_chat_tasks(self, tasks: list[Task]) -> None:
+        for task in tasks:
             await self._process_task(task)
 
+    async def _wait_for_stop_or_wakeup(self, timeout_sec: float) -> None:
+        if timeout_sec <= 0:
+            return
+        stop_wait = asyncio.create_task(self._stop_event.wait())
+        wake_wait = asyncio.create_task(self._wake_event.wait())
+        try:
+            done, pending = await asyncio.wait(
+                {stop_wait, wake_wait},
+                timeout=timeout_sec,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if wake_wait in done:
+                self._wake_event.clear()
+            for pending_task in pending:
+                pending_task.cancel()
+            for pending_task in pending:
+                with suppress(asyncio.CancelledError):
+                    await pending_task
+        finally:
+            if not stop_wait.done():
+                stop_wait.cancel()
+            if not wake_wait.done():
+                wake_wait.cancel()
+
     async def _acquire_user_session(self, chat_id: int) -> None:
         while not self._stop_event.is_set():
             if self._store.try_acquire_session_lease(
                 chat_id=chat_id,
                 owner="user",
-                ttl_sec=self._settings.session_lease_sec,
+                ttl_sec=self._session_lease_sec,
             ):
                 return
             await asyncio.sleep(0.5)
 
     async def _process_task(self, task: Task) -> None:
-        self._logger.info("Processing task #%s", task.id)
+        self._logger.debug("Processing task #%s", task.id)
         chat_session_id = self._store.get_chat_session_id(task.chat_id)
         prompt = build_prompt(
             user_text=task.text,
@@ -69,25 +137,27 @@ class Worker:
             include_bootstrap=not bool(chat_session_id),
         )
         await self._acquire_user_session(task.chat_id)
-        try:
-            await self._bot.send_chat_action(task.chat_id, ChatAction.TYPING)
-        except Exception:  # pragma: no cover
-            pass
+        now = time.monotonic()
+        if now - self._typing_last.get(task.chat_id, 0.0) >= 4.5:
+            self._typing_last[task.chat_id] = now
+            # Чистая UX-декорация: отправляем в фоне, не задерживая запуск
+            # codex на сетевой RTT.
+            action_task = asyncio.create_task(self._send_typing_action(task.chat_id))
+            self._bg_tasks.add(action_task)
+            action_task.add_done_callback(self._bg_tasks.discard)
 
         try:
-            result = await asyncio.to_thread(
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._runner_executor,
                 self._runner.run,
                 prompt,
                 chat_session_id,
             )
+            # Новый session id пишем одним коммитом с финальным статусом задачи,
+            # а не отдельной записью до доставки.
+            new_session_id = ""
             if result.session_id and result.session_id != chat_session_id:
-                self._store.set_chat_session_id(task.chat_id, result.session_id)
-                self._logger.info(
-                    "Task #%s: chat=%s session set to %s",
-                    task.id,
-                    task.chat_id,
-                    result.session_id,
-                )
+                new_session_id = result.session_id
             if result.success:
                 delivery = await deliver_agent_response(
                     bot=self._bot,
@@ -100,16 +170,50 @@ class Worker:
                     delivery.final_text,
                     delivery.sent_files,
                     delivery.send_errors,
+                    limit=self._max_result_chars,
+                )
+                # Запись в стор — в to_thread: fsync не держит event loop,
+                # параллельные чаты продолжают обслуживаться.
+                await asyncio.to_thread(
+                    self._store.complete_and_set_session,
+                    task.id,
+                    task_result_text,
+                    task.chat_id,
+                    new_session_id,
+                )
+                # Одна итоговая запись на задачу вместо отдельных логов
+                # про старт и смену сессии.
+                self._logger.info(
+                    "Task #%s done: chat=%s session=%s chars=%s",
+                    task.id,
+                    task.chat_id,
+                    new_session_id or chat_session_id or "-",
+                    len(task_result_text),
                 )
-                task_result_text = _trim(task_result_text, self._settings.max_result_chars)
-                self._store.complete_task(task.id, task_result_text)
                 return
 
             error_text = _trim(
                 f"Не удалось выполнить задачу #{task.id}.\n\n{result.message}",
-                self._settings.max_result_chars,
+                self._max_result_chars,
             )
-            self._store.fail_task(task.id, error_text)
-            await safe_send_text(self._bot, task.chat_id, error_text, self._logger)
+            # Запись статуса и отправка ошибки независимы — перекрываем
+            # fsync SQLite и сетевой RTT Telegram.
+            await asyncio.gather(
+                asyncio.to_thread(
+                    self._store.fail_and_set_session,
+                    task.id,
+                    error_text,
+                    task.chat_id,
+                    new_session_id,
+                ),
+                safe_send_text(self._bot, task.chat_id, error_text, self._logger),
+            )
+            self._logger.info("Task #%s failed: chat=%s", task.id, task.chat_id)
         finally:
             self._store.release_session_lease(task.chat_id, "user")
+
+    async def _send_typing_action(self, chat_id: int) -> None:
+        try:
+            await self._bot.send_chat_action(chat_id, ChatAction.TYPING)
+        except Exception:  # pragma: no cover
+            pass